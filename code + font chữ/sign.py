@@ -1,101 +1,133 @@
-# ==========================================
-# sign_pdf_footer.py - PyHanko 0.31.0 (Windows)
-# Footer chữ ký + ảnh + metadata
-# ==========================================
-from datetime import datetime
-from pyhanko.sign import signers, fields
-from pyhanko.stamp.text import TextStampStyle
-from pyhanko.pdf_utils import images
-from pyhanko.pdf_utils.text import TextBoxStyle
-from pyhanko.pdf_utils.layout import SimpleBoxLayoutRule, AxisAlignment, Margins
-from pyhanko.sign.general import load_cert_from_pemder
-from pyhanko_certvalidator import ValidationContext
-from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
-from pyhanko.sign.fields import SigFieldSpec
-
-# === ĐƯỜNG DẪN Windows ===
-PDF_IN = r"D:\btap2secu\pdf\Original.pdf"
-PDF_OUT = r"D:\btap2secu\pdf\signed.pdf"
-KEY_FILE = r"D:\btap2secu\key\private.pem"
-CERT_FILE = r"D:\btap2secu\key\certificate.pem"
-SIG_IMG = r"D:\btap2secu\ảnh\chuky.png"
-
-# === Tạo signer & validation context ===
-signer = signers.SimpleSigner.load(KEY_FILE, CERT_FILE, key_passphrase=None)
-vc = ValidationContext(trust_roots=[load_cert_from_pemder(CERT_FILE)])
-
-# === Mở PDF gốc và tạo writer ===
-with open(PDF_IN, "rb") as inf:
-    writer = IncrementalPdfFileWriter(inf)
-
-    # Lấy trang cuối cùng
-    pages = writer.root["/Pages"]
-    num_pages = pages.get("/Count", len(pages.get("/Kids", [])))
-    target_page = num_pages - 1  # index trang cuối
-
-    # Thêm field chữ ký ở trang cuối
-    fields.append_signature_field(
-        writer,
-        SigFieldSpec(
-            sig_field_name="FooterSig",
-            box=(50, 30, 550, 100),  # footer: dưới cùng trang cuối
-            on_page=target_page
-        )
-    )
-
-    # Ảnh nền (chữ ký tay)
-    background_img = images.PdfImage(SIG_IMG)
-
-    # Layout ảnh & text
-    bg_layout = SimpleBoxLayoutRule(
-        x_align=AxisAlignment.ALIGN_MIN,
-        y_align=AxisAlignment.ALIGN_MID,
-        margins=Margins(right=20)
-    )
-    text_layout = SimpleBoxLayoutRule(
-        x_align=AxisAlignment.ALIGN_MIN,
-        y_align=AxisAlignment.ALIGN_MID,
-        margins=Margins(left=150)
-    )
-
-    # Style chữ ký text
-    text_style = TextBoxStyle(font_size=13)
-    ngay_ky = datetime.now().strftime("%d/%m/%Y")
-    stamp_text = (
-        "NGUYEN HOANG VIET"
-        "\nSDT: 0359621318"
-        "\nMSV: K225480106074"
-        f"\nNgày ký: {ngay_ky}"
-    )
-
-    stamp_style = TextStampStyle(
-        stamp_text=stamp_text,
-        background=background_img,
-        background_layout=bg_layout,
-        inner_content_layout=text_layout,
-        text_box_style=text_style,
-        border_width=1,
-        background_opacity=1.0,
-    )
-
-    # Metadata chữ ký
-    meta = signers.PdfSignatureMetadata(
-        field_name="FooterSig",
-        reason="chữ ký số",
-        location="Thái Nguyên",
-        md_algorithm="sha256",
-    )
-
-    # PdfSigner
-    pdf_signer = signers.PdfSigner(
-        signature_meta=meta,
-        signer=signer,
-        stamp_style=stamp_style
-    )
-
-    # Ký và lưu
-    with open(PDF_OUT, "wb") as outf:
-        pdf_signer.sign_pdf(writer, output=outf)
-
-print("✅ PDF đã ký thành công với Footer ở trang cuối!")
-print("File lưu tại:", PDF_OUT)
+# ==========================================
+# sign_pdf_footer.py - PyHanko 0.31.0 (Windows)
+# Footer chữ ký + ảnh + metadata
+# ==========================================
+import warnings
+import functools
+from datetime import datetime
+from pyhanko.sign import signers, fields
+from pyhanko.stamp.text import TextStampStyle
+from pyhanko.pdf_utils import images
+from pyhanko.pdf_utils.text import TextBoxStyle
+from pyhanko.pdf_utils.layout import SimpleBoxLayoutRule, AxisAlignment, Margins
+from pyhanko.sign.general import load_cert_from_pemder
+from pyhanko_certvalidator import ValidationContext
+from pyhanko.pdf_utils.incremental_writer import IncrementalPdfFileWriter
+from pyhanko.sign.fields import SigFieldSpec
+
+# === ĐƯỜNG DẪN Windows ===
+PDF_IN = r"D:\btap2secu\pdf\Original.pdf"
+PDF_OUT = r"D:\btap2secu\pdf\signed.pdf"
+KEY_FILE = r"D:\btap2secu\key\private.pem"
+CERT_FILE = r"D:\btap2secu\key\certificate.pem"
+SIG_IMG = r"D:\btap2secu\ảnh\chuky.png"
+
+# Định dạng ngày ký dùng cho dòng "Ngày ký" trên dấu
+_DATE_FMT = "%d/%m/%Y"
+
+# Kiểm tra một lần lúc nạp module: md_algorithm="sha256" phải chạy trên backend
+# OpenSSL của hashlib (OpenSSL tự bật SHA-NI khi CPU hỗ trợ); nếu CPython rơi về
+# bản SHA-256 thuần thì bước băm ByteRange sẽ chậm hơn nhiều lần.
+try:
+    import _hashlib
+    _SHA256_ACCELERATED = hasattr(_hashlib, "openssl_sha256")
+except ImportError:
+    _SHA256_ACCELERATED = False
+if not _SHA256_ACCELERATED:
+    warnings.warn(
+        "hashlib không có backend OpenSSL — SHA-256 chạy bản dự phòng chậm, "
+        "nên cài CPython kèm OpenSSL 3.x để tận dụng SHA-NI."
+    )
+
+# === Tạo signer & validation context (một lần cho cả tiến trình) ===
+signer = signers.SimpleSigner.load(KEY_FILE, CERT_FILE, key_passphrase=None)
+vc = ValidationContext(trust_roots=[load_cert_from_pemder(CERT_FILE)])
+
+@functools.lru_cache(maxsize=1)
+def _sig_image():
+    """Giải mã ảnh chữ ký PNG đúng một lần.
+
+    Khi ký hàng loạt trong cùng tiến trình, các lần ký sau dùng lại
+    đối tượng ảnh đã giải mã thay vì decode zlib lại từ đầu.
+    """
+    return images.PdfImage(SIG_IMG)
+
+@functools.lru_cache(maxsize=1)
+def _stamp_style(ngay_ky):
+    """Dựng TextStampStyle cho ngày ký đã cho, cache để tái sử dụng."""
+    # Layout ảnh & text
+    bg_layout = SimpleBoxLayoutRule(
+        x_align=AxisAlignment.ALIGN_MIN,
+        y_align=AxisAlignment.ALIGN_MID,
+        margins=Margins(right=20)
+    )
+    text_layout = SimpleBoxLayoutRule(
+        x_align=AxisAlignment.ALIGN_MIN,
+        y_align=AxisAlignment.ALIGN_MID,
+        margins=Margins(left=150)
+    )
+
+    # Style chữ ký text
+    stamp_text = (
+        "NGUYEN HOANG VIET"
+        "\nSDT: 0359621318"
+        "\nMSV: K225480106074"
+        f"\nNgày ký: {ngay_ky}"
+    )
+    return TextStampStyle(
+        stamp_text=stamp_text,
+        background=_sig_image(),
+        background_layout=bg_layout,
+        inner_content_layout=text_layout,
+        text_box_style=TextBoxStyle(font_size=13),
+        border_width=1,
+        background_opacity=1.0,
+    )
+
+def sign_pdf(pdf_in, pdf_out):
+    """Ký một file PDF, đặt chữ ký ở footer trang cuối.
+
+    signer, validation context, style dấu và ảnh chữ ký đều được dùng
+    lại giữa các lần gọi — chỉ writer và field chữ ký là theo từng file.
+    """
+    with open(pdf_in, "rb") as inf:
+        writer = IncrementalPdfFileWriter(inf)
+
+        # Lấy trang cuối cùng
+        pages = writer.root["/Pages"]
+        num_pages = pages.get("/Count", len(pages.get("/Kids", [])))
+        target_page = num_pages - 1  # index trang cuối
+
+        # Thêm field chữ ký ở trang cuối
+        fields.append_signature_field(
+            writer,
+            SigFieldSpec(
+                sig_field_name="FooterSig",
+                box=(50, 30, 550, 100),  # footer: dưới cùng trang cuối
+                on_page=target_page
+            )
+        )
+
+        # Metadata chữ ký
+        meta = signers.PdfSignatureMetadata(
+            field_name="FooterSig",
+            reason="chữ ký số",
+            location="Thái Nguyên",
+            md_algorithm="sha256",
+        )
+
+        # PdfSigner
+        pdf_signer = signers.PdfSigner(
+            signature_meta=meta,
+            signer=signer,
+            stamp_style=_stamp_style(datetime.now().strftime(_DATE_FMT))
+        )
+
+        # Ký và lưu
+        with open(pdf_out, "wb") as outf:
+            pdf_signer.sign_pdf(writer, output=outf)
+
+if __name__ == "__main__":
+    sign_pdf(PDF_IN, PDF_OUT)
+    print("✅ PDF đã ký thành công với Footer ở trang cuối!")
+    print("File lưu tại:", PDF_OUT)
@@ -1,7 +1,14 @@
 import os
-import re
+import sys
+import mmap
+import time
+import shelve
+import inspect
 import hashlib
 import datetime
+import operator
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timezone, timedelta
 
 from pyhanko.pdf_utils.reader import PdfFileReader
@@ -15,70 +22,214 @@ PDF_PATH = r"D:\btap2secu\signed.pdf"
 CERT_PEM = r"D:\btap2secu\certificate.pem"
 LOG_FILE = r"D:\btap2secu\check.txt"
 
+# Múi giờ Việt Nam, dựng một lần ở mức module
+_TZ_VN = timezone(timedelta(hours=7))
+
+# Cache kết quả xác thực, khoá theo bộ ba (SHA256 chứng thư người ký, SHA256
+# toàn bộ file, SHA256 PEM tin cậy) — chỉ tài liệu y hệt, xác thực với đúng
+# trust root đó, mới trúng cache
+VERDICT_DB = os.path.join(os.path.expanduser("~"), ".cache", "pdfverify")
+VERDICT_TTL = 6 * 3600  # giây — sau đó phải hỏi lại OCSP/CRL
+
 # ================== HÀM PHỤ TRỢ ==================
 
-def safe_print(msg: str):
-    """In ra màn hình mà không lỗi font."""
+# Bộ đệm console: gom nhiều dòng rồi ghi stdout một lần,
+# thay vì mỗi print() một lần WriteFile xuống kernel
+_out_buf = []
+_OUT_FLUSH_EVERY = 32  # vẫn thấy tiến trình với báo cáo dài
+
+def _flush_out():
+    """Đẩy toàn bộ dòng đang đệm ra stdout trong một lần ghi."""
+    if not _out_buf:
+        return
+    text = "\n".join(_out_buf) + "\n"
+    _out_buf.clear()
     try:
-        print(msg)
+        sys.stdout.write(text)
     except UnicodeEncodeError:
-        print(msg.encode("utf-8", errors="ignore").decode("utf-8"))
+        sys.stdout.write(text.encode("utf-8", errors="ignore").decode("utf-8"))
+
+def safe_print(msg: str):
+    """Gom dòng vào bộ đệm console, tự flush theo lô để không lỗi font."""
+    _out_buf.append(msg)
+    if len(_out_buf) >= _OUT_FLUSH_EVERY:
+        _flush_out()
+
+# File log được main() mở một lần cho cả phiên kiểm tra
+_log_fh = None
 
 def log(msg: str):
     """Ghi nội dung ra console và file log."""
     safe_print(msg)
-    # Tạo thư mục log nếu chưa có
+    if _log_fh is not None:
+        _log_fh.write(msg)
+        _log_fh.write("\n")
+        return
+    # Dự phòng khi log() được gọi ngoài main(): mở/đóng theo từng dòng
     os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
     with open(LOG_FILE, "a", encoding="utf-8") as f:
         f.write(msg + "\n")
 
+# Bảng xoá sẵn mọi ký tự không phải hex, dùng cho str.translate (chạy trong C)
+_HEX_DELETE = str.maketrans(
+    "", "", "".join(chr(c) for c in range(256) if chr(c) not in "0123456789abcdefABCDEF")
+)
+
 def format_fp(fp):
     """Định dạng fingerprint cho dễ đọc."""
     if fp is None:
         return "N/A"
     if isinstance(fp, (bytes, bytearray)):
-        h = fp.hex().upper()
-    else:
-        s = str(fp)
-        h = re.sub(r"[^0-9A-Fa-f]", "", s).upper()
-        if not h:
-            return s
-        h = s
-    return " ".join(h[i:i+2] for i in range(0, len(h), 2))
-
-def compute_sha256_range(pdf_bytes: bytes, byte_range):
-    """Tính lại giá trị SHA256 dựa vào ByteRange trong chữ ký."""
-    b = list(byte_range)
-    data = pdf_bytes[b[0]:b[0]+b[1]] + pdf_bytes[b[2]:b[2]+b[3]]
-    return hashlib.sha256(data).hexdigest()
+        # bytes.hex với sep cài sẵn trong C, nhanh hơn nhiều so với join thủ công
+        return fp.hex(" ", 1).upper()
+    s = str(fp)
+    h = s.translate(_HEX_DELETE).upper()
+    if not h:
+        return s
+    return " ".join(h[i:i + 2] for i in range(0, len(h), 2))
+
+class IncrementalByteRangeHasher:
+    """Băm SHA256 theo ByteRange cho dữ liệu đến theo từng khối.
+
+    Dùng cho PDF rất lớn hoặc đang stream qua mạng: gọi update() với các
+    khối nối tiếp của file, phần giao với hai đoạn ByteRange được nạp dần
+    vào hash; bộ nhớ chiếm dụng là hằng số, không phụ thuộc cỡ file.
+    """
+
+    def __init__(self, byte_range):
+        b = list(byte_range)
+        # hai đoạn (đầu, cuối) được chữ ký phủ
+        self._segments = ((b[0], b[0] + b[1]), (b[2], b[2] + b[3]))
+        self._h = hashlib.sha256()
+        self._pos = 0  # offset tuyệt đối của byte kế tiếp sẽ nhận
+
+    def update(self, block):
+        """Nạp khối dữ liệu kế tiếp; chỉ phần giao với ByteRange được băm."""
+        mv = memoryview(block)
+        start = self._pos
+        end = start + len(mv)
+        for seg_start, seg_end in self._segments:
+            lo = max(start, seg_start)
+            hi = min(end, seg_end)
+            if lo < hi:
+                self._h.update(mv[lo - start:hi - start])
+        self._pos = end
+
+    def finalize(self):
+        """Trả về hexdigest SHA256 của hai đoạn ByteRange."""
+        return self._h.hexdigest()
+
+def compute_sha256_range(buf, byte_range):
+    """Tính lại giá trị SHA256 dựa vào ByteRange trong chữ ký.
+
+    `buf` là một buffer (mmap hoặc bytes) chứa trọn file; các lát cắt
+    memoryview nên hashlib vẫn đọc thẳng trên vùng nhớ gốc, không sao chép.
+    """
+    hasher = IncrementalByteRangeHasher(byte_range)
+    hasher.update(buf)
+    return hasher.finalize()
+
+# Xác định một lần cách truyền validation context cho validate_pdf_signature
+# (tên tham số thay đổi giữa các phiên bản pyHanko) thay vì thử/bắt TypeError
+# ở mỗi lần gọi.
+_val_params = inspect.signature(validation.validate_pdf_signature).parameters
+if "vc" in _val_params:
+    def _call_validate(sig_obj, trust_ctx):
+        return validation.validate_pdf_signature(sig_obj, vc=trust_ctx)
+elif "validation_context" in _val_params:
+    def _call_validate(sig_obj, trust_ctx):
+        return validation.validate_pdf_signature(sig_obj, validation_context=trust_ctx)
+else:
+    def _call_validate(sig_obj, trust_ctx):
+        return validation.validate_pdf_signature(sig_obj, trust_ctx)
+
+@functools.lru_cache(maxsize=4)
+def _load_trust_ctx(pem_path, mtime):
+    """Nạp chứng thư gốc và dựng ValidationContext, cache theo (đường dẫn, mtime).
+
+    Khi xác thực hàng loạt trong cùng một tiến trình, PEM chỉ phải parse một lần;
+    đổi file trên đĩa (mtime thay đổi) sẽ tự động nạp lại.
+    """
+    return ValidationContext(trust_roots=[load_cert_from_pemder(pem_path)],
+                             allow_fetching=True)
+
+def _is_verdict(verdict):
+    """Chỉ chấp nhận verdict (trusted, valid) gồm đúng hai giá trị bool."""
+    return (isinstance(verdict, tuple) and len(verdict) == 2
+            and all(isinstance(v, bool) for v in verdict))
+
+def _cached_verdict(cache_key):
+    """Tra kết quả (trusted, valid) đã lưu cho (chứng thư, file), nếu còn hạn.
+
+    Entry không đúng dạng bool (vd. status thiếu thuộc tính) bị coi là miss.
+    """
+    try:
+        with shelve.open(VERDICT_DB) as db:
+            entry = db.get(cache_key)
+            if entry and entry[1] > time.time() and _is_verdict(entry[0]):
+                return entry[0]
+    except Exception:
+        pass
+    return None
+
+def _store_verdict(cache_key, verdict):
+    """Lưu kết quả (trusted, valid) kèm hạn sử dụng vào cache trên đĩa.
+
+    Verdict chưa xác định (khác bool) không được lưu, tránh phát lại
+    một kết luận chưa từng được tính ra.
+    """
+    if not _is_verdict(verdict):
+        return
+    try:
+        os.makedirs(os.path.dirname(VERDICT_DB), exist_ok=True)
+        with shelve.open(VERDICT_DB) as db:
+            db[cache_key] = (verdict, time.time() + VERDICT_TTL)
+    except Exception:
+        pass
 
 def try_validation(sig_obj, trust_ctx):
     """
-    Thử gọi validate_pdf_signature theo nhiều kiểu để tránh lỗi không tương thích.
+    Gọi validate_pdf_signature theo quy ước đã xác định lúc nạp module.
     Trả về (status, error_message).
     """
-    attempts = [
-        ("vc", {"vc": trust_ctx}),
-        ("validation_context", {"validation_context": trust_ctx}),
-        ("positional", (trust_ctx,)),
-        ("none", {})
-    ]
-    last_err = None
-    for name, params in attempts:
-        try:
-            if name == "positional":
-                result = validation.validate_pdf_signature(sig_obj, *params)
-            elif name == "none":
-                result = validation.validate_pdf_signature(sig_obj)
-            else:
-                result = validation.validate_pdf_signature(sig_obj, **params)
-            return result, None
-        except TypeError as te:
-            last_err = te
-            continue
-        except Exception as e:
-            return None, f"Lỗi khi kiểm tra ({name}): {repr(e)}"
-    return None, f"Tất cả các cách gọi đều lỗi. Ngoại lệ cuối: {repr(last_err)}"
+    try:
+        return _call_validate(sig_obj, trust_ctx), None
+    except Exception as e:
+        return None, f"Lỗi khi kiểm tra: {repr(e)}"
+
+# attrgetter là builtin C: lấy cả bộ thuộc tính trong một lần gọi,
+# không phải probe hasattr/getattr từng tên ở tầng Python
+_FP_SHA1 = operator.attrgetter("sha1_fingerprint", "sha1")
+_FP_SHA256 = operator.attrgetter("sha256_fingerprint", "sha256")
+
+def _first_fp(cert, getter, names):
+    """Lấy fingerprint đầu tiên khác None, ưu tiên đường attrgetter."""
+    try:
+        return next((v for v in getter(cert) if v is not None), None)
+    except AttributeError:
+        # bản asn1crypto thiếu một trong các tên — quay về probe từng thuộc tính
+        for n in names:
+            v = getattr(cert, n, None)
+            if v is not None:
+                return v
+        return None
+
+def snapshot(obj, names):
+    """Chụp một lượt các thuộc tính quan tâm của obj thành dict.
+
+    Mỗi tên chỉ probe đúng một lần (getattr rồi __getitem__ dự phòng),
+    sau đó phần định dạng kết quả chỉ cần tra dict thông thường.
+    """
+    out = {}
+    for n in names:
+        v = getattr(obj, n, None)
+        if v is None:
+            try:
+                v = obj[n]
+            except Exception:
+                v = None
+        out[n] = v
+    return out
 
 def get_first_attr(obj, *names):
     """Lấy thuộc tính đầu tiên tồn tại trong danh sách tên."""
@@ -99,6 +250,7 @@ def get_first_attr(obj, *names):
 # ================== CHƯƠNG TRÌNH CHÍNH ==================
 
 def main():
+    global _log_fh
     # reset log file
     try:
         if os.path.exists(LOG_FILE):
@@ -106,16 +258,29 @@ def main():
     except Exception:
         pass
 
+    # mở file log một lần cho cả phiên thay vì open/close theo từng dòng
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+    _log_fh = open(LOG_FILE, "a", encoding="utf-8", buffering=1 << 16)
+    try:
+        _verify()
+    finally:
+        _flush_out()
+        _log_fh.close()
+        _log_fh = None
+
+def _verify():
     log("=== NGUYEN HOANG VIET ===")
     log(f"TIME CHECK: {datetime.datetime.now()}")
     log(f"FILE: {PDF_PATH}")
     log("=" * 65)
 
     # chuẩn bị ngữ cảnh xác thực
+    trust_tag = None  # digest của PEM tin cậy; None ⇒ không dùng cache verdict
     try:
         if os.path.exists(CERT_PEM):
-            cert_root = load_cert_from_pemder(CERT_PEM)
-            trust_ctx = ValidationContext(trust_roots=[cert_root], allow_fetching=True)
+            trust_ctx = _load_trust_ctx(CERT_PEM, os.path.getmtime(CERT_PEM))
+            with open(CERT_PEM, "rb") as pf:
+                trust_tag = hashlib.sha256(pf.read()).hexdigest()
             log("- Đã nạp chứng thư gốc từ PEM thành công.")
         else:
             trust_ctx = ValidationContext(trust_roots=None, allow_fetching=True)
@@ -130,13 +295,19 @@ def main():
 
     try:
         with open(PDF_PATH, "rb") as fh:
-            reader = PdfFileReader(fh)
-            signatures = list(reader.embedded_signatures)
-            if not signatures:
+            # ánh xạ file vào bộ nhớ cho bước tính hash (đọc zero-copy trên
+            # page cache); PdfFileReader vẫn nhận file handle vì bước băm
+            # nội bộ của pyHanko cần stream có readinto(), mmap không có
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            reader = PdfFileReader(fh, strict=False)
+            # chỉ chữ ký đầu tiên được dùng; lưu ý embedded_signatures của
+            # pyHanko 0.31 dựng sẵn cả danh sách, nên next() ở đây chỉ là
+            # cách lấy gọn phần tử đầu, không tiết kiệm lần parse nào
+            sig = next(iter(reader.embedded_signatures), None)
+            if sig is None:
                 log("Không phát hiện chữ ký nào trong tài liệu.")
                 return
 
-            sig = signatures[0]
             log(f"- Đã phát hiện vùng chữ ký: {sig.field_name or 'SignatureField'}")
 
             try:
@@ -148,18 +319,64 @@ def main():
             except Exception:
                 log("⚠️ Không thể đọc /ByteRange hoặc /Contents từ chữ ký.")
 
-            # tính lại hash SHA256
-            fh.seek(0)
-            full_pdf = fh.read()
+            # kiểm tra nhanh ByteRange có phủ kín file không (O(1))
+            # — tránh tốn công hash + xác thực mạng với file bị nối thêm dữ liệu
             if br:
-                hash_val = compute_sha256_range(full_pdf, br)
-                log(f"- Hash SHA256 được tính lại: {hash_val}")
-            else:
-                log("Không có ByteRange, bỏ qua bước tính hash.")
+                file_size = mm.size()
+                if br[0] != 0 or br[2] + br[3] != file_size:
+                    log(f"❌ ByteRange không phủ toàn bộ file "
+                        f"({br[2] + br[3]} / {file_size} bytes) — "
+                        "file có dấu hiệu bị giả mạo (nối thêm dữ liệu sau chữ ký).")
+                    return
 
-            # xác thực với pyHanko
-            log("- Bắt đầu xác minh chữ ký (thử nhiều cách tương thích)...")
-            status, err = try_validation(sig, trust_ctx)
+            # cache kết quả xác thực: chỉ dùng lại khi đúng tài liệu này
+            # (digest toàn file khớp) đã được xác thực với đúng chứng thư này
+            # và đúng PEM tin cậy này — thiếu PEM thì không cache, tránh phát
+            # lại verdict 'trusted' tính trên một trust root khác
+            cache_key = None
+            try:
+                signer = sig.signer_cert
+                if signer is not None and trust_tag is not None:
+                    cert_digest = hashlib.sha256(signer.dump()).hexdigest()
+                    doc_digest = hashlib.sha256(mm).hexdigest()
+                    cache_key = ":".join((cert_digest, doc_digest, trust_tag))
+            except Exception:
+                pass
+
+            cached = _cached_verdict(cache_key) if cache_key else None
+            if cached is not None:
+                trusted, ket_luan = cached
+                if br:
+                    log(f"- Hash SHA256 được tính lại: {compute_sha256_range(mm, br)}")
+                else:
+                    log("Không có ByteRange, bỏ qua bước tính hash.")
+                log("- Tài liệu này (cùng nội dung, cùng chứng thư) đã được xác thực "
+                    "gần đây — dùng lại kết quả trong cache, bỏ qua OCSP/CRL trực tuyến.")
+                if trusted is True:
+                    log("- Chuỗi chứng thư: ✅ Được tin cậy hoàn toàn (đã xác minh CA).")
+                elif ket_luan:
+                    log("- Chuỗi chứng thư: ⚠️ Chữ ký hợp lệ nhưng chưa xác định CA gốc.")
+                else:
+                    log("Chuỗi chứng thư: ❌ Không hợp lệ hoặc thiếu chứng thư xác minh.")
+                log("\n=== KẾT LUẬN CHUNG ===")
+                if ket_luan:
+                    log("Kết quả: CHỮ KÝ HỢP LỆ — FILE VẪN NGUYÊN VẸN.")
+                else:
+                    log("Kết quả: CHỮ KÝ KHÔNG HỢP LỆ HOẶC FILE ĐÃ BỊ CAN THIỆP.")
+                return
+
+            # chạy song song bước tính hash và bước xác thực pyHanko:
+            # hashlib nhả GIL khi băm và pyHanko nhả GIL khi chờ OCSP/CRL,
+            # nên tổng thời gian là max(hash, mạng) thay vì tổng hai bước
+            log("- Bắt đầu xác minh chữ ký (hash và xác thực chạy song song)...")
+            with ThreadPoolExecutor(max_workers=2) as ex:
+                f_hash = ex.submit(compute_sha256_range, mm, br) if br else None
+                f_val = ex.submit(try_validation, sig, trust_ctx)
+                if f_hash is not None:
+                    log(f"- Hash SHA256 được tính lại: {f_hash.result()}")
+                else:
+                    log("Không có ByteRange, bỏ qua bước tính hash.")
+                status, err = f_val.result()
             if err:
                 log(f" ⚠️ Lỗi khi xác thực: {err}")
             if status is None:
@@ -176,14 +393,22 @@ def main():
             except Exception:
                 pass
 
+            # chụp một lượt mọi thuộc tính cần in từ status
+            s = snapshot(status, (
+                "signer_cert", "signing_cert", "signing_certificate",
+                "trusted", "valid", "intact", "modification_level",
+                "signing_time", "signer_reported_dt", "signer_time",
+                "revinfo_validity", "revinfo_summary",
+            ))
+
             # thông tin chứng thư người ký
-            signer_cert = get_first_attr(status, "signer_cert", "signing_cert", "signing_certificate")
+            signer_cert = s["signer_cert"] or s["signing_cert"] or s["signing_certificate"]
             log("Thông tin về người ký:")
             if signer_cert is not None:
                 subject = get_first_attr(signer_cert, "subject")
                 readable = getattr(subject, "human_friendly", str(subject))
-                fp1 = get_first_attr(signer_cert, "sha1_fingerprint") or get_first_attr(signer_cert, "sha1")
-                fp2 = get_first_attr(signer_cert, "sha256_fingerprint") or get_first_attr(signer_cert, "sha256")
+                fp1 = _first_fp(signer_cert, _FP_SHA1, ("sha1_fingerprint", "sha1"))
+                fp2 = _first_fp(signer_cert, _FP_SHA256, ("sha256_fingerprint", "sha256"))
                 log(f"   - Tên chủ thể: {readable}")
                 log(f"   - SHA1 Fingerprint: {format_fp(fp1)}")
                 log(f"   - SHA256 Fingerprint: {format_fp(fp2)}")
@@ -191,8 +416,13 @@ def main():
                 log("   ⚠️ Không thể trích xuất thông tin người ký.")
 
             # kiểm tra chuỗi chứng thư
-            trusted = get_first_attr(status, "trusted")
-            valid = get_first_attr(status, "valid")
+            trusted = s["trusted"]
+            valid = s["valid"]
+            # 'valid' của pyHanko chỉ nói phần toán chữ ký; file còn nguyên vẹn
+            # hay không nằm ở 'intact' — kết luận chung phải gộp cả hai
+            ket_luan = bool(valid) and s["intact"] is not False
+            if cache_key and err is None:
+                _store_verdict(cache_key, (trusted, ket_luan))
             if trusted is True:
                 log("- Chuỗi chứng thư: ✅ Được tin cậy hoàn toàn (đã xác minh CA).")
             elif valid:
@@ -201,18 +431,17 @@ def main():
                 log("Chuỗi chứng thư: ❌ Không hợp lệ hoặc thiếu chứng thư xác minh.")
 
             # thông tin thu hồi (OCSP / CRL)
-            rev_info = get_first_attr(status, "revinfo_validity") or get_first_attr(status, "revinfo_summary")
+            rev_info = s["revinfo_validity"] or s["revinfo_summary"]
             if rev_info:
                 log(f"- Tình trạng chứng thư (OCSP/CRL): {rev_info}")
             else:
                 log("Không có dữ liệu OCSP hoặc CRL.")
 
             # thời gian ký
-            signing_time = get_first_attr(status, "signing_time", "signer_reported_dt", "signer_time")
+            signing_time = s["signing_time"] or s["signer_reported_dt"] or s["signer_time"]
             if signing_time:
-                tzvn = timezone(timedelta(hours=7))
                 try:
-                    vn_time = signing_time.astimezone(tzvn)
+                    vn_time = signing_time.astimezone(_TZ_VN)
                     log(f"- Thời gian ký (UTC): {signing_time}  → Giờ VN: {vn_time}")
                 except Exception:
                     log(f"- Thời gian ký: {signing_time}")
@@ -220,7 +449,7 @@ def main():
                 log("Không tìm thấy dấu thời gian (timestamp).")
 
             # kiểm tra chỉnh sửa sau khi ký
-            mod_level = get_first_attr(status, "modification_level")
+            mod_level = s["modification_level"]
             if mod_level == ModificationLevel.NONE:
                 log("- Kiểm tra chỉnh sửa: ✅ Không có thay đổi nào sau khi ký.")
             elif mod_level == ModificationLevel.FORM_FILLING:
@@ -230,7 +459,7 @@ def main():
 
             # tổng kết
             log("\n=== KẾT LUẬN CHUNG ===")
-            if valid:
+            if ket_luan:
                 log("Kết quả: CHỮ KÝ HỢP LỆ — FILE VẪN NGUYÊN VẸN.")
             else:
                 log("Kết quả: CHỮ KÝ KHÔNG HỢP LỆ HOẶC FILE ĐÃ BỊ CAN THIỆP.")
@@ -241,4 +470,15 @@ def main():
     log(f"\nQuá trình hoàn tất. Báo cáo được lưu tại: {os.path.abspath(LOG_FILE)}")
 
 if __name__ == "__main__":
-    main()
+    if "--profile" in sys.argv:
+        # chạy kèm cProfile để biết khâu nào đang chiếm thời gian:
+        # try_validation (mạng/CMS) hay compute_sha256_range (băm)
+        import cProfile
+        import pstats
+        pr = cProfile.Profile()
+        pr.enable()
+        main()
+        pr.disable()
+        pstats.Stats(pr).sort_stats("cumulative").print_stats(10)
+    else:
+        main()